@@ -15,8 +15,35 @@
 """
 
 from enum import Enum
+from operator import attrgetter, itemgetter
 import math
 
+# numba is optional, without it the force integration kernel below simply runs as python
+try:
+	from numba import njit, prange
+	_HAS_NUMBA = True
+except ImportError:
+	_HAS_NUMBA = False
+	prange = range
+	
+	def njit(*args, **kwargs):
+		if len(args) == 1 and callable(args[0]) and not kwargs:
+			return args[0]
+		return lambda func: func
+
+# numpy is optional as well, it's only used to integrate forces over a large number of entities at once
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+# PhysObj.kind tags, cheaper to compare than isinstance() in the hot paths
+KIND_CONCRETE = 0
+KIND_ENTITY = 1
+
+# Entity fields kept as Struct-of-Arrays columns in the space (see Space._arrays)
+_ENTITY_COLUMNS = ('vel_x', 'vel_y', 'force_x', 'force_y', 'mass', 'drag_coefficient')
+
 # Allow for other space events to be added in future
 class SpaceEventType(Enum):
 	COLLISION = 1
@@ -38,54 +65,188 @@ class CollisionEvent:
 		
 	# returns true if one of the parties is a concrete
 	def has_concrete(self): # 
-		return isinstance(self.party_one, Concrete) or isinstance(self.party_two, Concrete)
+		return self.party_one.kind == KIND_CONCRETE or self.party_two.kind == KIND_CONCRETE
 	
 	def has_entity(self):
-		return isinstance(self.party_one, Entity) or isinstance(self.party_two, Entity)
+		return self.party_one.kind == KIND_ENTITY or self.party_two.kind == KIND_ENTITY
 	
 	# in a combination of concrete and entity, returns the concrete party
 	def get_concrete(self):
-		if isinstance(self.party_one, Concrete):
+		if self.party_one.kind == KIND_CONCRETE:
 			return self.party_one
-		elif isinstance(self.party_two, Concrete):
+		elif self.party_two.kind == KIND_CONCRETE:
 			return self.party_two
 		else:
 			raise RuntimeError("No Concrete party when using get_concrete()")
 			
 	# in a combination of concrete and entity, returns the entity party		
 	def get_entity(self):
-		if isinstance(self.party_one, Entity):
+		if self.party_one.kind == KIND_ENTITY:
 			return self.party_one
-		elif isinstance(self.party_two, Entity):
+		elif self.party_two.kind == KIND_ENTITY:
 			return self.party_two
 		else:
 			raise RuntimeError("No Entity party when using get_entity()")
 
 
 		
+"""
+A bounding volume hierarchy over the concretes of a space, used to find the concretes near an entity
+without testing against every one of them.
+
+The concretes are sorted along a Morton (Z-order) curve of their centers and split in half recursively,
+so neighbouring concretes end up in the same branches whatever their size. Since concretes rarely move
+the tree is only built once, and refit() shrinks or grows the existing boxes when some of them do move.
+"""
+class _ConcreteTree:
+	LEAF_SIZE = 4 # most concretes held in a leaf
+	
+	def __init__(self, concretes):
+		self.concretes = list(concretes)
+		# one entry per node, children are always added before their parents
+		self.bounds = [] # [min_x, min_y, max_x, max_y]
+		self.children = [] # (left, right) node indices, None for leaves
+		self.items = [] # [(index in concretes, concrete), ...] for leaves, None otherwise
+		self.root = None
+		
+		if not self.concretes:
+			return
+		centers = [(concrete.x + 0.5*concrete.hitbox[0], concrete.y + 0.5*concrete.hitbox[1]) for concrete in self.concretes]
+		min_x = min(center[0] for center in centers)
+		min_y = min(center[1] for center in centers)
+		scale_x = 0xffff / ((max(center[0] for center in centers) - min_x) or 1)
+		scale_y = 0xffff / ((max(center[1] for center in centers) - min_y) or 1)
+		codes = [_morton_code(int((center[0] - min_x)*scale_x), int((center[1] - min_y)*scale_y)) for center in centers]
+		
+		order = sorted(range(len(self.concretes)), key=codes.__getitem__)
+		self.root = self._build([(i, self.concretes[i]) for i in order])
+	
+	def _build(self, items):
+		if len(items) <= self.LEAF_SIZE:
+			node = self._add_node(None, items)
+		else:
+			half = len(items) // 2
+			left = self._build(items[:half])
+			right = self._build(items[half:])
+			node = self._add_node((left, right), None)
+		self._fit(node)
+		return node
+	
+	def _add_node(self, children, items):
+		self.bounds.append([0, 0, 0, 0])
+		self.children.append(children)
+		self.items.append(items)
+		return len(self.bounds) - 1
+	
+	# fit the node's box around its concretes, or its children's boxes
+	def _fit(self, node):
+		bounds = self.bounds[node]
+		items = self.items[node]
+		if items is not None:
+			bounds[0] = min(concrete.x for _, concrete in items)
+			bounds[1] = min(concrete.y for _, concrete in items)
+			bounds[2] = max(concrete.x + concrete.hitbox[0] for _, concrete in items)
+			bounds[3] = max(concrete.y + concrete.hitbox[1] for _, concrete in items)
+		else:
+			left, right = self.children[node]
+			left = self.bounds[left]
+			right = self.bounds[right]
+			bounds[0] = min(left[0], right[0])
+			bounds[1] = min(left[1], right[1])
+			bounds[2] = max(left[2], right[2])
+			bounds[3] = max(left[3], right[3])
+	
+	# refit every box to where the concretes are now, keeping the tree's shape
+	def refit(self):
+		for node in range(len(self.bounds)):
+			self._fit(node)
+	
+	# all concretes in leaves whose boxes touch the given box, in the order of the concretes list
+	def query(self, min_x, min_y, max_x, max_y):
+		found = []
+		if self.root is None:
+			return found
+		stack = [self.root]
+		while stack:
+			node = stack.pop()
+			bounds = self.bounds[node]
+			if bounds[0] > max_x or bounds[2] < min_x or bounds[1] > max_y or bounds[3] < min_y:
+				continue
+			items = self.items[node]
+			if items is None:
+				stack.extend(self.children[node])
+			else:
+				found.extend(items)
+		if len(found) > 1:
+			found.sort(key=itemgetter(0))
+		return [concrete for _, concrete in found]
+		
 class Space:
 	def __init__(self):
 		self.events = []
+		self._event_pool = [] # CollisionEvents handed out again each update by add_collision_event()
+		self._event_count = 0 # number of pooled events in use this update
+		self._pair_set = set() # frozenset of the ids of both entities, for each entity-entity event, see already_compared()
+		self._pair_set_events = -1 # number of events _pair_set was built from, -1 when it needs building
 		self.entities = []
 		self.concretes = []
 		self.axis_speed_limit = 100 # less than the length of the smallest square
 		self.collision_coefficient = 3
 		self.gravity = 0.3
 		self.air_resistance = 0.3 # as a percentage of speed
+		self._tree = None # _ConcreteTree over the concretes, built on first use
+		self._tree_dirty = False # true when concretes moved since the tree was last fitted to them
+		self._all = [] # cached result of get_all()
+		self._scripted = [] # physObjs from _all with their own custom_script()
+		self._all_entities = None # copies of the entities and concretes lists _all was built from
+		self._all_concretes = None
+		# entity count from which forces are resolved with numpy (if installed)
+		# measured per resolve_forces(): 200 entities 122 us plain / 110 us numpy, 300: 197 / 155, 100: 64 / 67
+		self.vectorize_threshold = 250
+		self._arrays = {} # column name -> numpy array with one row per entity, row given by entity._idx
+		self._indexed_entities = [] # entities the rows of _arrays were laid out for
+		self.parallel_forces = False # integrate the vectorized forces with numba, see enable_parallel_forces()
 	
 	# get list of all physics objects
+	# the list is cached between calls, so don't modify it
 	def get_all(self):
-		return self.entities + self.concretes
+		# compared item by item, so objects swapped in or out of the lists directly are noticed too
+		if self._all_entities != self.entities or self._all_concretes != self.concretes:
+			self._refresh_all()
+		return self._all
+	
+	def _refresh_all(self):
+		self._all = self.entities + self.concretes
+		# only the physObjs that actually override custom_script() need calling each update,
+		# in their class or on the object itself (subclasses without __slots__ have a __dict__)
+		self._scripted = [physObj for physObj in self._all
+			if type(physObj).custom_script is not PhysObj.custom_script or 'custom_script' in getattr(physObj, '__dict__', ())]
+		self._all_entities = list(self.entities)
+		self._all_concretes = list(self.concretes)
 	
 	# Adding new physics objects to the space
 	# Sorry for the mix of camel case into this...
 	def add_physObj(self, physObj):
-		if isinstance(physObj, Entity):
+		if physObj.kind == KIND_ENTITY:
 			self.entities.append(physObj)
-		elif isinstance(physObj, Concrete):
+		elif physObj.kind == KIND_CONCRETE:
 			self.concretes.append(physObj)
+			self._tree = None
 		physObj.space = self
 	
+	# the AABB tree over the concretes, rebuilt if the concretes list changed and refitted if any of them moved
+	def _update_tree(self):
+		if self._tree is None or self._tree.concretes != self.concretes:
+			self._tree = _ConcreteTree(self.concretes)
+		elif self._tree_dirty:
+			self._tree.refit()
+		self._tree_dirty = False
+	
+	# all concretes whose bounding boxes touch the entity's, in the order they are in the concretes list
+	# call _update_tree() first, the space's loops do it once before going over their entities
+	def _query_tree(self, entity):
+		return self._tree.query(entity.x, entity.y, entity.x + entity.hitbox[0], entity.y + entity.hitbox[1])
+	
 	"""
 		1. Translate forces applied to an entity to accelerations and then to chances in velocities
 		2. If an entity and concrete are colliding BEFORE the update, mark the entity involved as as precollided
@@ -96,13 +257,22 @@ class Space:
 		6. do the same for Y
 	"""
 	def update(self):
-		# get rid of all events from previous update
-		self.events = []
+		# get rid of all events from previous update, their objects go back in the pool
+		self.events.clear()
+		self._event_count = 0
+		self._pair_set_events = -1
+		# no entities? only the concretes move, nothing can collide
+		if not self.entities:
+			self._move_all_concretes()
+			return self.custom_updates()
 		# translate forces to accelerations to velocities
 		self.resolve_forces()
-		self.mark_precollisions() # mark any objects that are precollidede
-		self.move_all_x() # attempt to move all objects in X, resolve any entity collisions
-		self.move_all_y()
+		if self.concretes:
+			self.mark_precollisions() # mark any objects that are precollidede
+			self.move_all_x() # attempt to move all objects in X, resolve any entity collisions
+			self.move_all_y()
+		else:
+			self._move_all_freeflight() # nothing for entities to hit but each other
 		self.search_for_entity_collisions()
 		self.resolve_entity_collisions()
 		self.apply_friction()
@@ -117,10 +287,12 @@ class Space:
 	there are not unresolved collided entity-concrete collisions.
 	"""
 	def mark_precollisions(self):
+		self._update_tree()
 		for entity in self.entities:
-			if self.check_for_concrete_colliding(entity):
+			if self._any_concrete_colliding(entity):
 				entity.pre_collided = True
 				entity.y -= 1
+				entity._cy = entity.y + entity._hh
 				print("precollision detected")
 			else:
 				entity.pre_collided = False
@@ -180,6 +352,10 @@ class Space:
 	# turn forces into accelerations via an objects mass (F = MA, A = F/M)
 	# finallly add the accelerations to the velocities of the ojects
 	def resolve_forces(self):
+		if np is not None and len(self.entities) >= self.vectorize_threshold:
+			return self._resolve_forces_vectorized()
+		
+		speed_limit = self.axis_speed_limit
 		# forces are only acted on by entities
 		for entity in self.entities:
 			# While we're here, might as well reset all these states
@@ -224,34 +400,84 @@ class Space:
 			else:
 				entity.vel_y -= air_resistance_vel_change
 			
-			speedlimitreached = False
+			# speed limits
+			vel_x = entity.vel_x
+			vel_y = entity.vel_y
+			entity.vel_x = speed_limit if vel_x > speed_limit else (-speed_limit if vel_x < -speed_limit else vel_x)
+			entity.vel_y = speed_limit if vel_y > speed_limit else (-speed_limit if vel_y < -speed_limit else vel_y)
 			
-			# x speed limit
-			if entity.vel_x > self.axis_speed_limit:
-				#print(" x force on me: ", entity.force_x, ", y force on me:", entity.force_y)
-				#print("positive x speed limit reached : vel_x = ", entity.vel_x, ", after correct it is ", self.axis_speed_limit)
-				entity.vel_x = self.axis_speed_limit
-				speedlimitreached = True
-				
-			elif entity.vel_x < -self.axis_speed_limit:
-				#print(" x force on me: ", entity.force_x, ", y force on me:", entity.force_y)
-				#print("negative x speed limit reached", entity.vel_x, ", after correct it is ", self.axis_speed_limit)
-				entity.vel_x = -self.axis_speed_limit
-				speedlimitreached = True
-				
-			# y speed limit
-			if entity.vel_y > self.axis_speed_limit:
-				#print(" x force on me: ", entity.force_x, ", y force on me:", entity.force_y)
-				#print("positive y speed limit reached", entity.vel_y, ", after correct it is ", self.axis_speed_limit)
-				entity.vel_y = self.axis_speed_limit
-				speedlimitreached = True
+			entity.force_x = entity.force_y = 0 # reset to 0
+	
+	# lay out one row of the SoA arrays per entity, if the entity list has changed since last time
+	def _index_entities(self):
+		if self._indexed_entities == self.entities:
+			return
+		count = len(self.entities)
+		self._arrays = {name: np.zeros(count) for name in _ENTITY_COLUMNS}
+		for i, entity in enumerate(self.entities):
+			entity._idx = i
+		self._indexed_entities = list(self.entities)
+	
+	# compile the numba force kernel now (it takes a moment) rather than stalling the first big update
+	# returns whether the vectorized forces will use it from now on
+	def enable_parallel_forces(self):
+		if np is None or not _HAS_NUMBA:
+			return False
+		ones = np.ones(1)
+		_integrate(np.zeros(1), np.zeros(1), np.zeros(1), np.zeros(1), ones, ones,
+			float(self.axis_speed_limit), float(self.gravity), float(self.air_resistance))
+		self.parallel_forces = True
+		return True
+	
+	# same as resolve_forces but as whole array operations over every entity at once
+	def _resolve_forces_vectorized(self):
+		self._index_entities()
+		entities = self.entities
+		arrays = self._arrays
+		count = len(entities)
+		
+		# load the entities into the arrays
+		for name in _ENTITY_COLUMNS:
+			arrays[name][:] = np.fromiter(map(attrgetter(name), entities), float, count)
+		vel_x = arrays['vel_x']
+		vel_y = arrays['vel_y']
+		
+		if self.parallel_forces:
+			# entities don't depend on each other here, so numba can spread them over threads
+			_integrate(vel_x, vel_y, arrays['force_x'], arrays['force_y'], arrays['mass'], arrays['drag_coefficient'],
+				float(self.axis_speed_limit), float(self.gravity), float(self.air_resistance))
+		else:
+			mass = arrays['mass']
+			drag = arrays['drag_coefficient']*self.air_resistance
+			
+			# forces applied to object through apply_force()
+			vel_x += arrays['force_x']/mass
+			vel_y += arrays['force_y']/mass
+			
+			# gravity applied to object
+			vel_y -= self.gravity
+			
+			# air resistance, stopping the objects it would otherwise send flying backward
+			for vel in (vel_x, vel_y):
+				air_resistance_vel_change = drag*vel/mass
+				too_powerful = np.abs(vel) < np.abs(air_resistance_vel_change)
+				vel -= air_resistance_vel_change
+				vel[too_powerful] = 0
 				
-			elif entity.vel_y < -self.axis_speed_limit:
-				#print(" x force on me: ", entity.force_x, ", y force on me:", entity.force_y)
-				#print("negative y speed limit reached", entity.vel_y, ", after correct it is ", -self.axis_speed_limit)
-				entity.vel_y = -self.axis_speed_limit
-				speedlimitreached = True
+				# speed limit
+				np.clip(vel, -self.axis_speed_limit, self.axis_speed_limit, out=vel)
 			
+			arrays['force_x'][:] = 0
+			arrays['force_y'][:] = 0
+		
+		# write the results back to the entities
+		for entity, new_vel_x, new_vel_y in zip(entities, vel_x.tolist(), vel_y.tolist()):
+			entity.hit_down = False
+			entity.hit_left = False
+			entity.hit_right = False
+			entity.hit_up = False
+			entity.vel_x = new_vel_x
+			entity.vel_y = new_vel_y
 			entity.force_x = entity.force_y = 0 # reset to 0
 	
 	# useful for sliding mechanics
@@ -263,27 +489,43 @@ class Space:
 	# then resolve any collisions
 	def move_all_x(self):
 		# first move all concretes
+		tree_dirty = self._tree_dirty
 		for concrete in self.concretes:
 			concrete.x += concrete.vel_x
+			# start of the frame's movement, catch up on anything changed since the last update
+			# the cached extents are from before, so they tell if the concrete moved, by velocity or directly
+			cx = concrete._cx
+			cy = concrete._cy
+			hw = concrete._hw
+			hh = concrete._hh
+			concrete._refresh_extents()
+			if concrete._cx != cx or concrete._cy != cy or concrete._hw != hw or concrete._hh != hh:
+				tree_dirty = True
+		self._tree_dirty = tree_dirty
+		self._update_tree()
 			
 		for entity in self.entities:
 			# move all entities in the x axis
 			entity.x += entity.vel_x
+			entity._refresh_extents()
 			
 			# ignore collisions for precollided entites
 			if entity.pre_collided:
 				continue
 			
-			# get all collided concretes
-			collided_concretes = self.get_collided_concretes(entity)
+			# find the collided concrete with the max overlap in the x
+			sig_concrete = collision_rect = None
+			for concrete in self._query_tree(entity):
+				if entity.is_collided_with(concrete):
+					rect = entity._cached_collision_rec(concrete)
+					if collision_rect is None or rect[0] > collision_rect[0]:
+						sig_concrete = concrete
+						collision_rect = rect
 			
 			# no concretes that the entity collided with? great, move on to next entity
-			if len(collided_concretes) == 0:
+			if sig_concrete is None:
 				continue
 			
-			# get the max overlap in the x
-			sig_concrete, collision_rect = self.get_max_collision_rect_x(entity, collided_concretes)
-			
 			velocity_difference = entity.vel_x - sig_concrete.vel_x
 			
 			if velocity_difference > 0:
@@ -295,11 +537,42 @@ class Space:
 			self.add_collision_event(entity, sig_concrete, collision_rect, Axis.X)
 			
 			# move back in opposite direction of the relative velocity of the entity to the collided concrete 
-			entity.x -= math.copysign(collision_rect[0] , velocity_difference)
+			entity.x -= collision_rect[0] if velocity_difference >= 0 else -collision_rect[0]
+			entity._cx = entity.x + entity._hw
 			entity.vel_x = sig_concrete.vel_x
 	
+	# move all entities in both axes when there are no concretes
+	# same as mark_precollisions, move_all_x and move_all_y would do, without looking for concretes
+	def _move_all_freeflight(self):
+		for entity in self.entities:
+			entity.pre_collided = False
+			entity.x += entity.vel_x
+			entity.y += entity.vel_y
+			entity._refresh_extents()
+	
+	# move all concretes in both axes when there are no entities
+	# nothing looks at the tree or the cached extents until entities are added,
+	# move_all_x() refreshes the extents then and the tree is refitted
+	def _move_all_concretes(self):
+		for concrete in self.concretes:
+			concrete.x += concrete.vel_x
+			concrete.y += concrete.vel_y
+		self._tree_dirty = True
+	
+	# events are taken from a pool that is reused every update, so don't hold on to
+	# an event past the update it was made in
 	def add_collision_event(self, party_one, party_two, collision_rect, axis):
-		self.events.append(CollisionEvent(party_one, party_two, collision_rect, axis))
+		if self._event_count < len(self._event_pool):
+			event = self._event_pool[self._event_count]
+			event.collision_rect = collision_rect
+			event.party_one = party_one
+			event.party_two = party_two
+			event.axis = axis
+		else:
+			event = CollisionEvent(party_one, party_two, collision_rect, axis)
+			self._event_pool.append(event)
+		self._event_count += 1
+		self.events.append(event)
 
 			
 	# attempt to move all objects in y
@@ -307,26 +580,34 @@ class Space:
 	def move_all_y(self):
 		# first move all concretes
 		for concrete in self.concretes:
-			concrete.y += concrete.vel_y
+			if concrete.vel_y:
+				concrete.y += concrete.vel_y
+				concrete._cy = concrete.y + concrete._hh
+				self._tree_dirty = True
+		self._update_tree()
 			
 		for entity in self.entities:
 			# move all entities in the y axis
 			entity.y += entity.vel_y
+			entity._cy = entity.y + entity._hh
 			
 			# ignore collisions for precollided entites
 			if entity.pre_collided:
 				continue
 			
-			# get all collided concretes
-			collided_concretes = self.get_collided_concretes(entity)
+			# find the collided concrete with the max overlap in the y
+			sig_concrete = collision_rect = None
+			for concrete in self._query_tree(entity):
+				if entity.is_collided_with(concrete):
+					rect = entity._cached_collision_rec(concrete)
+					if collision_rect is None or rect[1] > collision_rect[1]:
+						sig_concrete = concrete
+						collision_rect = rect
 			
 			# no concretes that the entity collided with? great, move on
-			if len(collided_concretes) == 0:
+			if sig_concrete is None:
 				continue
 			
-			# get the max overlap in the x
-			sig_concrete, collision_rect = self.get_max_collision_rect_y(entity, collided_concretes)
-			
 			# ========================== IF YOU WANNA ADD COLLISION EVENT STUFF ADD IT HERE =========================================================
 			
 			velocity_difference = entity.vel_y - sig_concrete.vel_y
@@ -340,87 +621,76 @@ class Space:
 			self.add_collision_event(entity, sig_concrete, collision_rect, Axis.Y)
 			
 			# move back in opposite direction of the relative velocity of the entity to the collided concrete 
-			entity.y -= math.copysign(collision_rect[1] , velocity_difference)
+			entity.y -= collision_rect[1] if velocity_difference >= 0 else -collision_rect[1]
+			entity._cy = entity.y + entity._hh
 			entity.vel_y = sig_concrete.vel_y
 			
 			# apply frictional force
 	
-	# get a list of all concretes that this entity is collided with
-	def get_collided_concretes(self, entity):
-		collided_concretes = []
-		for concrete in self.concretes:
-			if entity.is_collided_with(concrete):
-				collided_concretes.append(concrete)
-		return collided_concretes
-		
-	# gets the concrete of largest collision AND the collision rect
-	# only considers the x overlap
-	# must be given at least one concrete
-	# returns (concrete, collision_rect)
-	def get_max_collision_rect_x(self, entity, collided_concretes):
-		max_x_collision_rect = entity.get_collision_rec(collided_concretes[0])
-		max_x_concrete = collided_concretes[0]
-		for concrete in collided_concretes:
-			collision_rect = entity.get_collision_rec(concrete)
-			if collision_rect[0] > max_x_collision_rect[0]:
-				max_x_collision_rect = collision_rect
-				max_x_concrete = concrete
-		return (max_x_concrete, max_x_collision_rect)
-			
-	# gets the concrete of largest collision AND the collision rect
-	# only considers the y overlap
-	# must be given at least one concrete
-	# returns (concrete, collision_rect)
-	def get_max_collision_rect_y(self, entity, collided_concretes):
-		max_y_collision_rect = entity.get_collision_rec(collided_concretes[0])
-		max_y_concrete = collided_concretes[0]
-		for concrete in collided_concretes:
-			collision_rect = entity.get_collision_rec(concrete)
-			if collision_rect[1] > max_y_collision_rect[1]:
-				max_y_collision_rect = collision_rect
-				max_y_concrete = concrete
-		return (max_y_concrete, max_y_collision_rect)
-			
 	# returns true if entity collides with any concretes in spcae
+	# concretes moved or resized directly (not by velocity or set_pos) are only picked up by the next update
 	def check_for_concrete_colliding(self, entity):
-		for concrete in self.concretes:
+		self._update_tree()
+		return self._any_concrete_colliding(entity)
+	
+	# check_for_concrete_colliding() once the tree is up to date
+	def _any_concrete_colliding(self, entity):
+		for concrete in self._query_tree(entity):
 			if entity.is_collided_with(concrete):
 				return True
 		return False
 	
 	# execute any custom physics scripts during each update
 	def custom_updates(self):
-		for physObj in self.get_all():
+		self.get_all() # brings _scripted up to date
+		for physObj in self._scripted:
 			physObj.custom_script()
 	
+	# Sort-and-sweep along the X axis: only entities whose X intervals overlap
+	# are handed to the narrow phase, and each pair is visited exactly once
 	def search_for_entity_collisions(self):
-		for i in range(len(self.entities)):
-			for j in range(i, len(self.entities)):
-				entity1 = self.entities[i]
-				entity2 = self.entities[j]
-				# double check to make sure we're not comparing the SAME entity
-				if entity1 is not entity2 and not self.already_compared(entity1, entity2):
-					if entity1.is_collided_with(entity2):
-						collision_rect = entity1.get_collision_rec(entity2)
-						# add collision event to list
-						# ternary if statement
-						axis = Axis.Y
-						if collision_rect[1] > collision_rect[0]:
-							axis = Axis.X
-						self.add_collision_event(entity1, entity2, collision_rect, axis)
+		intervals = [(entity.x, entity.x + entity.hitbox[0], i, entity) for i, entity in enumerate(self.entities)]
+		intervals.sort(key=itemgetter(0))
+		
+		active = []
+		for interval in intervals:
+			min_x, max_x, i, entity = interval
+			# drop anything that ends before this entity begins, it can't overlap anything further along
+			active = [other for other in active if other[1] > min_x]
+			for other in active:
+				other_entity = other[3]
+				# cheap Y interval rejection before the full hitbox test, off of the cached centers and half heights
+				if abs(entity._cy - other_entity._cy) >= entity._hh + other_entity._hh:
+					continue
+				# keep the party order the same as the entities list
+				if other[2] < i:
+					entity1, entity2 = other_entity, entity
+				else:
+					entity1, entity2 = entity, other_entity
+				if entity1.is_collided_with(entity2):
+					collision_rect = entity1._cached_collision_rec(entity2)
+					# add collision event to list
+					# ternary if statement
+					axis = Axis.Y
+					if collision_rect[1] > collision_rect[0]:
+						axis = Axis.X
+					self.add_collision_event(entity1, entity2, collision_rect, axis)
+			active.append(interval)
 	
+	# true if there is already a collision event between the two entities this update
+	# the set of pairs is only built when this is asked, and again if events were added since
 	def already_compared(self, entity1, entity2):
-		for event in self.events:
-			both = (event.party_one, event.party_two)
-			if entity1 in both and entity2 in both:
-				return True
-		return False
+		if self._pair_set_events != len(self.events):
+			self._pair_set = {frozenset((id(event.party_one), id(event.party_two))) for event in self.events
+				if event.party_one.kind == KIND_ENTITY and event.party_two.kind == KIND_ENTITY}
+			self._pair_set_events = len(self.events)
+		return frozenset((id(entity1), id(entity2))) in self._pair_set
 	
 	# push apart things
 	def resolve_entity_collisions(self):
 		for event in self.events:
 			if event.type() == SpaceEventType.COLLISION:
-				if isinstance(event.party_one, Entity) and isinstance(event.party_two, Entity):
+				if event.party_one.kind == KIND_ENTITY and event.party_two.kind == KIND_ENTITY:
 					self._resolve_entity_entity(event)
 	
 	# entities resolve collisions with other entities via forces
@@ -440,8 +710,8 @@ class Space:
 				right = collision_event.party_one
 				left = collision_event.party_two
 			# apply equal and opposite on x axis square 
-			left.apply_force(-1 * (collision_rect[0]**1)*self.collision_coefficient, 0)
-			right.apply_force((collision_rect[0]**1)*self.collision_coefficient, 0)
+			left.apply_force(-1 * collision_rect[0]*self.collision_coefficient, 0)
+			right.apply_force(collision_rect[0]*self.collision_coefficient, 0)
 		
 		# y axis has larger collision length
 		else:
@@ -453,11 +723,14 @@ class Space:
 				higher_y = collision_event.party_one
 				lower_y = collision_event.party_two
 			# apply equal and opposite on x axis
-			lower_y.apply_force(0, -1*(collision_rect[1]**1)*self.collision_coefficient)
-			higher_y.apply_force(0, (collision_rect[1]**1)*self.collision_coefficient)
+			lower_y.apply_force(0, -1*collision_rect[1]*self.collision_coefficient)
+			higher_y.apply_force(0, collision_rect[1]*self.collision_coefficient)
 		
 		
 class PhysObj:
+	# slots instead of a __dict__, these are touched many times every update (__weakref__ keeps them weak-referenceable)
+	__slots__ = ('_prev_pos', 'x', 'y', 'vel_x', 'vel_y', 'hitbox', 'coefficient_friction', 'space', '_hw', '_hh', '_cx', '_cy', '__weakref__')
+	
 	def __init__(self,pos,hitbox):
 		self._prev_pos = pos#previous updates position, avoid round off errors
 		self.x = pos[0]
@@ -467,11 +740,21 @@ class PhysObj:
 		self.hitbox = hitbox
 		self.coefficient_friction = 0.5# nonzero value
 		self.space = None
+		self._refresh_extents()
 		
 	def set_pos(self, x, y):
 		self._prev_pos = (self.x,self.y)
 		self.x = x
 		self.y = y
+		self._refresh_extents()
+	
+	# cache the half extents and center of the hitbox, used by _cached_collision_rec()
+	# the space keeps these up to date as it moves things, set_pos() does too
+	def _refresh_extents(self):
+		self._hw = self.hitbox[0]*0.5
+		self._hh = self.hitbox[1]*0.5
+		self._cx = self.x + self._hw
+		self._cy = self.y + self._hh
 		
 	
 	def get_pos(self):
@@ -482,10 +765,19 @@ class PhysObj:
 	
 	# Returns true if this PhysObj is currently intersecting the other PhysObj
 	def is_collided_with(self, other):
-		return do_hitboxes_collide(self.get_pos(), self.hitbox, other.get_pos(), other.hitbox)
+		return do_hitboxes_collide(self.x, self.y, self.hitbox[0], self.hitbox[1], other.x, other.y, other.hitbox[0], other.hitbox[1])
 	
 	def get_collision_rec(self, other):
-		return get_collision_rect(self.get_pos(), self.hitbox, other.get_pos(), other.hitbox)
+		return get_collision_rect(self.x, self.y, self.hitbox[0], self.hitbox[1], other.x, other.y, other.hitbox[0], other.hitbox[1])
+	
+	# get_collision_rec() off of the cached extents, for the space's own loops where they're known to be current
+	def _cached_collision_rec(self, other):
+		return _rect(self._cx, self._cy, self._hw, self._hh, other._cx, other._cy, other._hw, other._hh)
+	
+	# override to run custom physics each update, see Space.custom_updates()
+	# an override assigned to an object already in a space is only picked up once the space's lists change
+	def custom_script(self):
+		pass
 		
 
 """
@@ -494,6 +786,10 @@ concrete objects HOWEVER a glitch in physics may allow the Entity to walk throug
 resulting in a precollision.
 """
 class Entity(PhysObj):
+	__slots__ = ('mass', 'pre_collided', 'force_x', 'force_y', 'friction', 'drag_coefficient', 'bouncy',
+		'hit_down', 'hit_left', 'hit_right', 'hit_up', '_idx')
+	kind = KIND_ENTITY
+	
 	def __init__(self,pos,hitbox, mass):
 		PhysObj.__init__(self,pos,hitbox)
 		self.mass = mass
@@ -501,6 +797,9 @@ class Entity(PhysObj):
 		self.force_x = 0
 		self.force_y = 0
 		
+		# row of this entity in its space's SoA arrays, assigned by the space
+		self._idx = None
+		
 		# sliding friction
 		self.friction = 0.5
 		
@@ -524,17 +823,20 @@ class Entity(PhysObj):
 		self.force_x += x
 		self.force_y += y
 		
-	def custom_script(self):
-		pass
-		
 	
 class Concrete(PhysObj):
+	__slots__ = ('friction',)
+	kind = KIND_CONCRETE
+	
 	def __init__(self,pos,hitbox):
 		PhysObj.__init__(self,pos,hitbox)
 		self.friction = 0.1
-		
-	def custom_script(self):
-		pass
+	
+	# concretes are only expected to move by their velocity, so let the space know about teleports
+	def set_pos(self, x, y):
+		PhysObj.set_pos(self, x, y)
+		if self.space is not None:
+			self.space._tree_dirty = True
 
 # Get the dimensions of hitbox at a position overlapping 
 # Another hitbox at a position
@@ -543,47 +845,59 @@ class Concrete(PhysObj):
 # This is to ensure that the physics that uses this overlap as a correction, it will apply the correct
 # position transformation. In other words, when an entity collides with a concrete, it will be resolved
 # by getting the collision rectangle. It will use this collisionrectangle to move the entity back, before the collision.
-def get_collision_rect(pos1, hitbox1, pos2, hitbox2):
-    hitbox1_width = hitbox1[0]
-    hitbox1_height = hitbox1[1]
+# Both hitboxes are given as plain numbers (x, y, width, height), no tuples to build or unpack
+def get_collision_rect(x1, y1, width1, height1, x2, y2, width2, height2):
+    half_width1 = 0.5 * width1
+    half_height1 = 0.5 * height1
+    half_width2 = 0.5 * width2
+    half_height2 = 0.5 * height2
+    return _rect(x1 + half_width1, y1 + half_height1, half_width1, half_height1,
+                 x2 + half_width2, y2 + half_height2, half_width2, half_height2)
 
-    hitbox2_width = hitbox2[0]
-    hitbox2_height = hitbox2[1]
+# Shared by get_collision_rect and PhysObj._cached_collision_rec
+# _rect works off of the centers and half extents of the hitboxes:
+# the overlap is how much closer the centers are than the sum of half extents
+def _rect(center_x1, center_y1, half_width1, half_height1, center_x2, center_y2, half_width2, half_height2):
+    x_overlap = half_width1 + half_width2 - abs(center_x1 - center_x2)
+    y_overlap = half_height1 + half_height2 - abs(center_y1 - center_y2)
 
-    minimum_dist_x = hitbox1_width + hitbox2_width
-    minimum_dist_y = hitbox1_height + hitbox2_height
-
-    actual_dist_x = (hitbox1_width + hitbox2_width) / 2 + math.fabs(
-        (0.5 * hitbox1_width + pos1[0]) - (0.5 * hitbox2_width + pos2[0]))
-    actual_dist_y = (hitbox1_height + hitbox2_height) / 2 + math.fabs(
-        (0.5 * hitbox1_height + pos1[1]) - (0.5 * hitbox2_height + pos2[1]))
-
-    x_overlap = minimum_dist_x - actual_dist_x
-    y_overlap = minimum_dist_y - actual_dist_y
-	
     return (x_overlap + 0.01, y_overlap + 0.01)
 
-# takes two objects with the fields:
-#	sprite: Surface
-# 	pos: (int/float, int/float)
+# takes the position and size of two hitboxes as plain numbers (x, y, width, height)
 # see ref A in purple book
-def do_hitboxes_collide(pos1, hitbox1, pos2, hitbox2):
+def do_hitboxes_collide(x1, y1, width1, height1, x2, y2, width2, height2):
     # addition of the widths and heights to show the minimum distance they both can be
     # (either can be less but BOTH must be less to show they MUST be overlaping
-    width1 = hitbox1[0]
-    height1 = hitbox1[1]
-    width2 = hitbox2[0]
-    height2 = hitbox2[1]
+    return x1 < x2 + width2 and \
+           x1 + width1 > x2 and \
+           y1 < y2 + height2 and \
+           height1 + y1 > y2
+
+# The per entity steps of resolve_forces over the SoA arrays, updating vel_x/vel_y and clearing the forces in place
+@njit(parallel=True, fastmath=True, cache=True)
+def _integrate(vel_x, vel_y, force_x, force_y, mass, drag_coefficient, speed_limit, gravity, air_resistance):
+    for i in prange(vel_x.shape[0]):
+        # forces applied to object through apply_force(), and gravity
+        vx = vel_x[i] + force_x[i] / mass[i]
+        vy = vel_y[i] + force_y[i] / mass[i] - gravity
+
+        # air resistance, unless it's so strong it would send the object flying backward
+        change_x = drag_coefficient[i] * air_resistance * vx / mass[i]
+        change_y = drag_coefficient[i] * air_resistance * vy / mass[i]
+        vx = 0.0 if abs(vx) < abs(change_x) else vx - change_x
+        vy = 0.0 if abs(vy) < abs(change_y) else vy - change_y
 
-    rec1_x = pos1[0]
-    rec1_y = pos1[1]
-    rec2_x = pos2[0]
-    rec2_y = pos2[1]
+        vel_x[i] = speed_limit if vx > speed_limit else (-speed_limit if vx < -speed_limit else vx)
+        vel_y[i] = speed_limit if vy > speed_limit else (-speed_limit if vy < -speed_limit else vy)
+        force_x[i] = 0.0
+        force_y[i] = 0.0
 
-    return rec1_x < rec2_x + width2 and \
-           rec1_x + width1 > rec2_x and \
-           rec1_y < rec2_y + height2 and \
-           height1 + rec1_y > rec2_y
+# interleave the bits of two 16 bit integers, x taking the even bits and y the odd ones
+def _morton_code(x, y):
+	code = 0
+	for bit in range(16):
+		code |= ((x >> bit) & 1) << (2*bit) | ((y >> bit) & 1) << (2*bit + 1)
+	return code
 
 def same_sign(num1, num2):
 	return (num1 < 0 and num2 < 0) or (num1 > 0 and num2 > 0) or (num1 == 0 and num2 == 0)
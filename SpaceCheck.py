@@ -0,0 +1,128 @@
+"""
+	Sanity checks for the optimized paths in the Space Module
+
+	1. The concrete tree must find the same colliding concretes as checking every concrete,
+	   also after concretes are added or removed directly, or moved or resized directly and then updated
+	2. With numpy (and numba) installed, the vectorized forces must give the same simulation
+	   as the plain python ones
+"""
+import contextlib
+import io
+import random
+import sys
+import Space as space_module
+from Space import *
+
+# the space prints a line for every precollision, keep the output to the results
+quiet = contextlib.redirect_stdout(io.StringIO())
+failures = 0
+
+def report(name, passed, detail=""):
+	global failures
+	if not passed:
+		failures += 1
+	print(("ok    " if passed else "FAIL  ") + name + (" (" + detail + ")" if detail else ""))
+
+# a walled room with random concretes, one moving, and random entities
+def build_scene(seed, entity_count, concrete_count):
+	rnd = random.Random(seed)
+	space = Space()
+	space.gravity = -0.25
+	space.collision_coefficient = 2
+	space.add_physObj(Concrete((0,700),(2000,100)))
+	space.add_physObj(Concrete((0,0),(100,700)))
+	space.add_physObj(Concrete((1900,0),(100,700)))
+	for i in range(concrete_count):
+		space.add_physObj(Concrete((rnd.uniform(100,1800), rnd.uniform(100,650)), (rnd.choice([20,40,80,300]), rnd.choice([10,20,40]))))
+	moving_concrete = Concrete((300,100),(100,30))
+	moving_concrete.vel_x = 1
+	moving_concrete.friction = 1
+	space.add_physObj(moving_concrete)
+	for i in range(entity_count):
+		entity = Entity((rnd.uniform(120,1800), rnd.uniform(0,600)), (rnd.choice([20,30,50]),)*2, rnd.choice([5,10]))
+		entity.vel_x = rnd.uniform(-3,3)
+		entity.bouncy = rnd.choice([0,0.5])
+		entity.friction = rnd.choice([0.5,0.2])
+		space.add_physObj(entity)
+	return space, moving_concrete
+
+# run a scene and return the final state of every entity
+def simulate(seed, vectorize_threshold, parallel_forces=False, steps=300):
+	space, moving_concrete = build_scene(seed, 100, 30)
+	space.vectorize_threshold = vectorize_threshold
+	if parallel_forces:
+		space.enable_parallel_forces()
+	rnd = random.Random(seed + 1)
+	with quiet:
+		for step in range(steps):
+			if moving_concrete.x > 600:
+				moving_concrete.vel_x = -1
+			elif moving_concrete.x < 200:
+				moving_concrete.vel_x = 1
+			if step % 7 == 0:
+				space.entities[0].apply_force(rnd.uniform(-2,2), -4)
+			space.update()
+	return [(entity.x, entity.y, entity.vel_x, entity.vel_y) for entity in space.entities]
+
+def largest_difference(state1, state2):
+	return max(abs(value1 - value2) for entity1, entity2 in zip(state1, state2) for value1, value2 in zip(entity1, entity2))
+
+# every entity must collide with the same concretes, whether found through the tree or by checking them all
+def tree_matches_brute_force(space):
+	space._update_tree()
+	for entity in space.entities:
+		found = [concrete for concrete in space._query_tree(entity) if entity.is_collided_with(concrete)]
+		expected = [concrete for concrete in space.concretes if entity.is_collided_with(concrete)]
+		if found != expected or space.check_for_concrete_colliding(entity) != bool(expected):
+			return False
+	return True
+
+def check_tree():
+	rnd = random.Random(7)
+	space = build_scene(7, 100, 60)[0]
+	space.gravity = 0
+	passed = True
+	with quiet:
+		for step in range(200):
+			concrete = rnd.choice(space.concretes)
+			change = step % 5
+			# direct writes to a concrete's position or hitbox aren't seen until the next update,
+			# neither is set_pos() on a concrete appended to the list instead of added with add_physObj()
+			direct = change < 2 or concrete.space is None
+			if change == 0:
+				concrete.x += rnd.uniform(-50,50) # moved directly, not by velocity
+			elif change == 1:
+				concrete.hitbox = (rnd.uniform(10,300), rnd.uniform(10,40))
+			elif change == 2:
+				space.concretes.append(Concrete((rnd.uniform(100,1800), rnd.uniform(100,650)), (40,20)))
+			elif change == 3 and len(space.concretes) > 10:
+				space.concretes.remove(concrete)
+			else:
+				concrete.set_pos(rnd.uniform(100,1800), rnd.uniform(100,650))
+			if not direct:
+				passed = passed and tree_matches_brute_force(space)
+			space.update()
+			passed = passed and tree_matches_brute_force(space)
+	report("concrete tree against every concrete", passed)
+
+def check_vectorized():
+	if space_module.np is None:
+		print("skip  vectorized forces (numpy is not installed)")
+		return
+	for seed in range(3):
+		plain = simulate(seed, vectorize_threshold=10**9)
+		vectorized = simulate(seed, vectorize_threshold=0)
+		difference = largest_difference(plain, vectorized)
+		report("numpy forces, scene %d" % seed, difference < 1e-6, "largest difference %g" % difference)
+	if not space_module._HAS_NUMBA:
+		print("skip  parallel forces (numba is not installed)")
+		return
+	for seed in range(3):
+		plain = simulate(seed, vectorize_threshold=10**9)
+		parallel = simulate(seed, vectorize_threshold=0, parallel_forces=True)
+		difference = largest_difference(plain, parallel)
+		report("numba forces, scene %d" % seed, difference < 1e-6, "largest difference %g" % difference)
+
+check_tree()
+check_vectorized()
+sys.exit(1 if failures else 0)